@@ -7,7 +7,9 @@
 
   INSTALLED ON: Linux 4.14.79-v7+ #1159 SMP armv7l GNU/Linux
 
-  DEPENDENCIES: /usr/bin/python3
+  DEPENDENCIES: /usr/bin/python3 >= 3.7, rrdtool, ping, pytz
+    optional: aioping >= 0.3.1 (in-process ICMP when run as root or with
+    CAP_NET_RAW), orjson (faster config file parsing), rrdcached (-R)
 
   OUTPUT: Input, Output, Uptime, Hostname data for rrdtool (MRTG) to ingest.
 
@@ -40,21 +42,41 @@
   12Oct18 John Ullrey removed global variable statemens pylint3 complained about
   30Nov18 John Ullrey print help if no args, made --data and --html required
   21Jan19 John Ullrey now capturing stderr in subprocess.check_output
+  15Oct26 agent       concurrent pings, optional aioping, cached DNS lookups
+  15Oct26 agent       pickled config cache, optional orjson
+  15Oct26 agent       pool of "rrdtool -" processes for updates and graphs
+  15Oct26 agent       added -L/--loop daemon mode and -R/--rrdcached option
+  15Oct26 agent       html pages built from module level templates
 
 '''
 # -----------------------------------------------------------------------------
 # --- Required Python Libraries. ----------------------------------------------
 # -----------------------------------------------------------------------------
 import sys
+import os
 import argparse
+import asyncio
 import subprocess
 import re
+import shlex
+import socket
+import statistics
 import time
 import json
-from collections import OrderedDict
+import pickle
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
 from datetime import datetime, timedelta
-from copy import deepcopy
 from pytz import timezone
+try:
+	import orjson
+except ImportError: # fall back to the (slower) standard json module
+	orjson = None
+try:
+	import aioping # 0.3.1 or later
+except ImportError: # fall back to spawning PING for every host
+	aioping = None
 
 # -----------------------------------------------------------------------------
 # --- Custom Function Imports.  -----------------------------------------------
@@ -68,13 +90,118 @@ from pytz import timezone
 # --- Global variables. -------------------------------------------------------
 # -----------------------------------------------------------------------------
 VER = '0.2'
-STR_EPOCTIME = str(int(time.time()))
-STR_DATETIME = str(datetime.now())
 PING = '/bin/ping'
-GREP = '/bin/grep'
+ICMP_TIMEOUT = 2
+DNS_TTL = 3600 # seconds a resolved host address is reused for
 RRDTOOL = '/usr/bin/rrdtool'
+RRDTOOL_WORKERS = os.cpu_count() or 1
+CACHE_EXT = '.cache.pkl'
 GRAPH_WIDTH = '398'
 GRAPH_HEIGHT = '246'
+TRAIL_SLASH_RE = re.compile(r'/$')
+JSON_EXT_RE = re.compile(r'\.json$')
+POLL_INTERVAL = 60
+# Availability bands and RTT line drawn from the AVRTT and AVAIL DEFs
+GRAPH_ELEMENTS = [
+	"CDEF:AVAIL1=AVAIL,0,20,LIMIT,UN,UNKN,INF,IF",
+	"CDEF:AVAIL2=AVAIL,21,40,LIMIT,UN,UNKN,INF,IF",
+	"CDEF:AVAIL3=AVAIL,39,79,LIMIT,UN,UNKN,INF,IF",
+	"CDEF:AVAIL4=AVAIL,80,99,LIMIT,UN,UNKN,INF,IF",
+	"CDEF:AVAIL5=AVAIL,100,100,LIMIT,UN,UNKN,INF,IF",
+	'COMMENT:Availability\\:',
+	"AREA:AVAIL1#FF0000:0-20%",
+	"AREA:AVAIL2#FFFF00:21-40%",
+	"AREA:AVAIL3#FF8000:39-79%",
+	"AREA:AVAIL4#00FFFF:80-99%",
+	"AREA:AVAIL5#00FF00:100%",
+	'LINE1:AVRTT#0000ff:RTT latency ms',
+	'GPRINT:AVRTT:LAST:Current RTT\\: %5.2lf ms',
+	'GPRINT:AVRTT:AVERAGE:Avg RTT\\: %5.2lf ms',
+	'GPRINT:AVRTT:MAX:Max RTT\\: %5.2lf ms',
+	'GPRINT:AVRTT:MIN:Min RTT\\: %5.2lf ms']
+# --- HTML page templates, filled in with str.format() -----------------------
+HTML_HEAD = '''<!DOCTYPE html>
+<html>
+	<head>
+		<title>{title}</title>
+		<meta http-equiv="refresh" content="60">
+		<meta http-equiv="cache-control" content="no-cache">
+		<meta http-equiv="pragma" content="no-cache">
+		<meta http-equiv="expires" content="{expires}">
+		<meta http-equiv="generator" content="MHAG {ver}">
+		<meta http-equiv="date" content="{expires}">
+		<meta http-equiv="content-type" content="text/html; charset=iso-8859-15">
+{style}	</head>
+	<body>
+		<h1>{title}</h1>
+'''
+HTML_INDEX_TABLE = '''		<table border=0 cellpadding=0 cellspacing=10>
+{rows}		</table>
+'''
+HTML_INDEX_ROW = '''			<tr><td><div><b>{target}</b></div><div><a href="{target}.html"><img border=1 src="{target}1mx12h.png" title="1mx12h" alt="1mx12h"></a><br></div></td></tr>
+'''
+HTML_GRAPH = '''		<div class="graph">
+			<h2>{target} ({intvldur})</h2>
+			<img src="{target}{intvldur}.png" title="{intvldur}" alt="{intvldur}">
+		</div>
+'''
+HTML_FOOT = '''	<div align="right"><a href="https://github.com/jullrey/MHAG/blob/master/LICENSE" target="MHAG License"><i>MHAG License</i></a></div>
+	</body>
+</html>
+'''
+HTML_STYLE = '''		                <style type="text/css">
+                        body {
+                                background-color: #ffffff;
+                        }
+                        div {
+                                border-bottom: 2px solid #aaa;
+                                padding-bottom: 10px;
+                                margin-bottom: 5px;
+                        }
+                        div h2 {
+                                font-size: 1.2em;
+                        }
+                        div.graph img {
+                                margin: 5px 0;
+                        }
+                        div.graph table, div#legend table {
+                                font-size: .8em;
+                        }
+                        div.graph table td {
+                                padding: 0 10px;
+                                text-align: right;
+                        }
+                        div table .in th, div table td span.in {
+                                color: #00cc00;
+                        }
+                        div table .out th, div table td span.out {
+                                color: #0000ff;
+                        }
+                        div#legend th {
+                                text-align: right;
+                        }
+                        div#footer {
+                                border: none;
+                                font-size: .8em;
+                                font-family: Arial, Helvetica, sans-serif;
+                                width: 476px;
+                        }
+                        div#footer img {
+                                border: none;
+                                height: 25px;
+                        }
+                        div#footer address {
+                                text-align: right;
+                        }
+                        div#footer #version {
+                                margin: 0;
+                                padding: 0;
+                                float: left;
+                                width: 88px;
+                                text-align: right;
+                        }
+                </style>
+'''
 LINE = '------------------------------------------------------------------------'
 # -----------------------------------------------------------------------------
 # --- Main function declaration -----------------------------------------------
@@ -82,23 +209,19 @@ LINE = '------------------------------------------------------------------------
 def main():
 	'''main function calls the rest'''
 
-	cfg_dict = {}
-	gfx_dict = {}
-	pol_dict = {}
-
 	# ARGS = parse_args() moved to if __name__ == '__main__': at end of script
 	if ARGS.comments:
 		print(__doc__)
 		sys.exit()
 
 	# Check and add trailing / to directory CLI variables
-	if ('htmldir' in ARGS) and not re.search('/$', ARGS.htmldir):
+	if ('htmldir' in ARGS) and not TRAIL_SLASH_RE.search(ARGS.htmldir):
 		ARGS.htmldir += '/'
-	if ('datadir' in ARGS) and not re.search('/$', ARGS.datadir):
+	if ('datadir' in ARGS) and not TRAIL_SLASH_RE.search(ARGS.datadir):
 		ARGS.datadir += '/'
 
 	# Correct custom cfgfile input
-	if not re.search(r'.json$', ARGS.cfgfile):
+	if not JSON_EXT_RE.search(ARGS.cfgfile):
 		ARGS.cfgfile += '.json'
 
 	# Set default database file
@@ -112,43 +235,72 @@ def main():
 	dbug("BEGIN degugging info to STDERR")
 	dbug("ARGS: "+str(ARGS))
 
+	# One rrdtool process for the database, gen_graphs adds more as needed
+	with ExitStack() as stack:
+		rrds = [stack.enter_context(rrdtool_start())]
+		while True:
+			started = time.time()
+			if not ARGS.loop:
+				poll_cycle(stack, rrds)
+				break
+
+			# one failed cycle (config typo, dead rrdtool...) must not stop
+			# the daemon, log it and carry on with the next interval
+			try:
+				poll_cycle(stack, rrds)
+			except Exception as err: # pylint: disable=broad-except
+				print('ERROR: polling cycle failed: '+repr(err), \
+					file=sys.stderr, flush=True)
+			restart_rrdtool(stack, rrds)
+
+			# sleep until the next polling interval starts
+			time.sleep(max(0, POLL_INTERVAL - (time.time() - started)))
+
+	dbug(LINE)
+	dbug("END debugging output to STDERR")
+
+# -----------------------------------------------------------------------------
+# --- Remaining function declarations -----------------------------------------
+# -----------------------------------------------------------------------------
+def poll_cycle(stack, rrds):
+	'''Poll all hosts once, then update the database, graphs and html'''
+
+	cfg_dict = {}
+	gfx_dict = {}
+	pol_dict = {}
+
+	# Time stamps for everything recorded during this polling cycle
+	str_epoctime = str(int(time.time()))
+	str_datetime = str(datetime.now())
+
 	# Read/create [config.json] file
-	read_config(ARGS.cfgfile, cfg_dict, gfx_dict)
+	read_config(ARGS.cfgfile, cfg_dict, gfx_dict, str_epoctime)
 
 	# Make a copy of cfg_dict to hold temporary polling data
-	pol_dict = deepcopy(cfg_dict)
+	pol_dict = {target: dict(params) for target, params in cfg_dict.items()}
 
 	# Verify/update Round Robin Database (RRD) file matches config file
-	verify_rrd(cfg_dict)
+	verify_rrd(cfg_dict, rrds[0])
 
 	# Ping all hosts
-	ping_hosts(cfg_dict, pol_dict)
+	ping_hosts(cfg_dict, pol_dict, str_epoctime, str_datetime)
 	dbug(LINE)
 
 	# Calculate uptime
 	calc_uptime(cfg_dict)
 
 	# Write updates to config file
-	gfxprm_sort = OrderedDict(sorted(gfx_dict.items(), key=lambda \
-		x: int(x[1]['step'])))
-
-	with open(ARGS.cfgfile, mode='w', encoding='utf-8') as cfile:
-		cfile.write(json.dumps([cfg_dict, gfxprm_sort], indent=4))
+	write_config(ARGS.cfgfile, cfg_dict, gfx_dict)
 
 	# Write data to database
-	update_database(pol_dict)
+	update_database(pol_dict, rrds[0], str_epoctime)
 
 	# Generate Graphs
-	gen_graphs(pol_dict, gfx_dict)
+	gen_graphs(pol_dict, gfx_dict, stack, rrds)
 	gen_html_index(pol_dict, gfx_dict)
 
-	dbug(LINE)
-	dbug("END debugging output to STDERR")
-
-# -----------------------------------------------------------------------------
-# --- Remaining function declarations -----------------------------------------
 # -----------------------------------------------------------------------------
-def read_config(cfgfile, cfgdic, gfxdic):
+def read_config(cfgfile, cfgdic, gfxdic, str_epoctime):
 	'''Read config file'''
 
 	need2write = False
@@ -156,8 +308,7 @@ def read_config(cfgfile, cfgdic, gfxdic):
 	dbug(LINE)
 	try:
 		dbug('Reading '+cfgfile+' configuration file.')
-		with open(cfgfile, 'r', encoding='utf-8') as cfile:
-			listofdic = json.load(cfile)
+		listofdic = load_config(cfgfile)
 
 		cfgdic.update(listofdic[0])
 		gfxdic.update(listofdic[1])
@@ -166,11 +317,11 @@ def read_config(cfgfile, cfgdic, gfxdic):
 		dbug('Exception:', 'FileNotFoundError')
 		# config file doesn't exist so create default one
 		cfgdic.update({'Cloudflare': {'FQDN': 'one.one.one.one', 'COUNT': '5',\
-			'LASTFAIL': STR_DATETIME},\
+			'LASTFAIL': str_epoctime},\
 			'Google': {'FQDN': 'google-public-dns-a.google.com', 'COUNT': '5',\
-			'LASTFAIL': STR_DATETIME},\
+			'LASTFAIL': str_epoctime},\
 			'OpenDNS': {'FQDN': 'resolver1.opendns.com', 'COUNT': '5',\
-			'LASTFAIL': STR_DATETIME},})
+			'LASTFAIL': str_epoctime},})
 		need2write = True
 
 	if not gfxdic:
@@ -192,50 +343,97 @@ def read_config(cfgfile, cfgdic, gfxdic):
 				'HOUR:24:DAY:7:DAY:30'},})
 		need2write = True
 
+	# Order the graph intervals by step once, dicts keep insertion order
+	gfxprm_sort = sorted(gfxdic.items(), key=lambda x: int(x[1]['step']))
+	gfxdic.clear()
+	gfxdic.update(gfxprm_sort)
+
 	if need2write:
-		gfxprm_sort = OrderedDict(sorted(gfxdic.items(), key=lambda \
-			x: int(x[1]['step'])))
-		with open(cfgfile, mode='w', encoding='utf-8') as cfile:
-			cfile.write(json.dumps([cfgdic, gfxprm_sort], indent=4))
-		dbug("Created default config file.\n"+cfgfile+"\n"+ \
-			json.dumps([cfgdic, gfxprm_sort], indent=4))
+		write_config(cfgfile, cfgdic, gfxdic)
+		dbug("Created default config file.\n"+cfgfile, lambda: "\n"+ \
+			json.dumps([cfgdic, gfxdic], indent=4))
 
 # -----------------------------------------------------------------------------
-def verify_rrd(cfgdic):
+def load_config(cfgfile):
+	'''Load config file, from its pickle cache when the file is unchanged'''
+
+	stat = os.stat(cfgfile)
+	fingerprint = (stat.st_mtime_ns, stat.st_size)
+
+	# the cache is only a shortcut, anything wrong with it means parse json
+	try:
+		with open(cfgfile+CACHE_EXT, 'rb') as pfile:
+			cached_fp, cached_digest, listofdic = pickle.load(pfile)
+		cfgdic, gfxdic = listofdic
+		if not (isinstance(cfgdic, dict) and isinstance(gfxdic, dict)):
+			raise TypeError('unexpected config cache contents')
+	except Exception: # pylint: disable=broad-except
+		cached_fp = cached_digest = None
+
+	if fingerprint == cached_fp:
+		dbug('Using cached '+cfgfile+CACHE_EXT)
+		return listofdic
+
+	# mtime/size changed, fall back to comparing the content
+	with open(cfgfile, 'rb') as cfile:
+		content = cfile.read()
+	if hashlib.sha1(content).digest() == cached_digest:
+		dbug('Using cached '+cfgfile+CACHE_EXT+' (content unchanged)')
+		return listofdic
+
+	if orjson:
+		return orjson.loads(content)
+	return json.loads(content.decode('utf-8'))
+
+# -----------------------------------------------------------------------------
+def write_config(cfgfile, cfgdic, gfxdic):
+	'''Write config file and refresh its pickle cache'''
+
+	if orjson:
+		content = orjson.dumps([cfgdic, gfxdic], option=orjson.OPT_INDENT_2)
+	else:
+		content = json.dumps([cfgdic, gfxdic], indent=2).encode('utf-8')
+	with open(cfgfile, mode='wb') as cfile:
+		cfile.write(content)
+
+	stat = os.stat(cfgfile)
+	with open(cfgfile+CACHE_EXT, 'wb') as pfile:
+		pickle.dump(((stat.st_mtime_ns, stat.st_size), \
+			hashlib.sha1(content).digest(), [cfgdic, gfxdic]), pfile)
+
+# -----------------------------------------------------------------------------
+def verify_rrd(cfgdic, rrd):
 	'''Verify and/or update the RRD file associated with config file'''
 
 	dbug(LINE)
 	dbug('Verify Round Robin Database file.')
-	cmd = RRDTOOL+' info '+ARGS.dbfile+' |'+GREP+' index'
-	info_cmd = [cmd]
-	try:
-		info = subprocess.check_output(info_cmd, shell=True, stderr=subprocess.STDOUT)
-		dbug(cmd+"\n"+info.decode('utf-8'))
-
-	except subprocess.CalledProcessError:
-		dbug('Exception:', 'subprocess.CalledProcessError')
+	cmd = [RRDTOOL, 'info', ARGS.dbfile]
+	reply = rrdtool_send(rrd, cmd)
 
+	if reply.startswith('ERROR:') or '\nERROR:' in reply:
+		dbug('rrdtool info returned:', reply)
 
 		# rrd file that corresponds to the config file does not exist
 		dbug('Creating '+ARGS.dbfile+' file')
 		# create rrd file that matches the config file
-		cmd = RRDTOOL+' create '+ARGS.dbfile+' --step 1m '
+		cmd = [RRDTOOL, 'create', ARGS.dbfile, '--step', '1m']
 		for target in sorted(cfgdic.keys()):
-			cmd += 'DS:'+target+'-AVRTT:GAUGE:65:1:2000 '
-			cmd += 'DS:'+target+'-AVAIL:GAUGE:65:0:100 '
-
-		cmd += 'RRA:LAST:0:1:365d '
-		cmd += 'RRA:AVERAGE:0.5:5m:24h '
-		cmd += 'RRA:AVERAGE:0.5:30m:7d '
-		cmd += 'RRA:AVERAGE:0.5:2h:28d '
-		cmd += 'RRA:AVERAGE:0.5:1d:365d '
-		dbug(cmd)
-		create_cmd = [cmd]
-		try:
-			output = subprocess.check_output(create_cmd, shell=True)
-		except subprocess.CalledProcessError:
-			dbug('Exception:', 'subprocess.CalledProcessError')
-			dbug("ERROR:", "\n"+output.decode('utf-8'))
+			cmd.append('DS:'+target+'-AVRTT:GAUGE:65:1:2000')
+			cmd.append('DS:'+target+'-AVAIL:GAUGE:65:0:100')
+
+		cmd.append('RRA:LAST:0:1:365d')
+		cmd.append('RRA:AVERAGE:0.5:5m:24h')
+		cmd.append('RRA:AVERAGE:0.5:30m:7d')
+		cmd.append('RRA:AVERAGE:0.5:2h:28d')
+		cmd.append('RRA:AVERAGE:0.5:1d:365d')
+		dbug(lambda: ' '.join(cmd))
+		reply = rrdtool_send(rrd, cmd)
+		if not reply.startswith('OK '):
+			dbug("ERROR:", "\n"+reply)
+
+	else:
+		dbug(lambda: ' '.join(cmd)+"\n"+'\n'.join(line for line in \
+			reply.splitlines() if 'index' in line))
 
 # -----------------------------------------------------------------------------
 def calc_uptime(cfgdic):
@@ -243,59 +441,59 @@ def calc_uptime(cfgdic):
 
 	dbug('Calculate up times')
 
+	now = time.time()
+	now_hms = datetime.fromtimestamp(now).strftime("%H:%M:%S")
+
 	for target in sorted(cfgdic.keys()):
-		lastfail = datetime.strptime(cfgdic[target]['LASTFAIL'], "%Y-%m-%d %H:%M:%S.%f")
-		uptime = datetime.now().strftime("%H:%M:%S")
-		uptime += ' UP (since last ping fail) for '
-		delta = abs(datetime.now() - lastfail)
-		mins, secs = divmod(delta.total_seconds(), 60)
-		hours, mins = divmod(mins, 60)
-		days, hours = divmod(hours, 12)
-
-		if days > 0:
-			uptime += str(round(days))+" days, "
-		if hours > 0:
-			uptime += str(round(hours))+" hours, "
-		if mins > 0:
-			uptime += str(round(mins))+" minutes, "
-		if secs > 0:
-			uptime += str(round(secs))+" seconds"
-		uptime += "."
+		try:
+			lastfail = int(cfgdic[target]['LASTFAIL'])
+		except ValueError: # LASTFAIL from older versions is a datetime string
+			lastfail = int(datetime.strptime(cfgdic[target]['LASTFAIL'], \
+				"%Y-%m-%d %H:%M:%S.%f").timestamp())
+			cfgdic[target]['LASTFAIL'] = str(lastfail)
+		days, rem = divmod(int(abs(now - lastfail)), 86400)
+		hours, rem = divmod(rem, 3600)
+		mins, secs = divmod(rem, 60)
+		parts = [str(val)+' '+name for val, name in ((days, 'days'), \
+			(hours, 'hours'), (mins, 'minutes'), (secs, 'seconds')) if val] \
+			or ['0 seconds'] # failed during this very poll
+		uptime = now_hms+' UP (since last ping fail) for '+', '.join(parts)+'.'
 		cfgdic[target]['UPTIME'] = uptime
 		dbug(target+':', cfgdic[target]['UPTIME'])
 
 # -----------------------------------------------------------------------------
-def ping_hosts(cfgdic, poldic):
+def ping_hosts(cfgdic, poldic, str_epoctime, str_datetime):
 	'''ping through all hosts'''
 
 	dbug(LINE)
-	dbug('Spawn Ping commands...')
-	# Build command and launch each subprocess
-	for target in sorted(poldic.keys()):
-		cmd = [PING, '-qc', poldic[target]['COUNT'], poldic[target]['FQDN']]
-		dbug(target, cmd)
-		poldic[target].update({'PID': subprocess.Popen(cmd, \
-			stdout=subprocess.PIPE, stderr=subprocess.PIPE)})
+	targets = sorted(poldic)
+	resolved = resolve_hosts(cfgdic, poldic, targets, str_epoctime)
 
-	# Wait for each subprocess to end
-	for target in sorted(poldic.keys()):
-		poldic[target]['PID'].wait()
+	if aioping is not None and icmp_allowed():
+		dbug('Send ICMP echo requests...')
+		asyncio.run(_icmp_ping_all(poldic, resolved, str_epoctime))
+
+	else:
+		dbug('Spawn Ping commands...')
+		# Launch every ping concurrently and collect their output
+		results = asyncio.run(_ping_all(poldic, resolved))
+
+		# Process each suprocess output
+		for target, (output, errors) in zip(resolved, results):
+			dbug(LINE)
+			# parse the ping output
+			parse_ping(poldic, target, output, errors, str_epoctime)
 
 	dbug('Pings attmpts completed. Displaying results:')
-	# Process each suprocess output
-	for target in sorted(poldic.keys()):
-		output, errors = poldic[target]['PID'].communicate()
+	for target in targets:
 
 		dbug(LINE)
 
-		# parse the ping output
-		parse_ping(poldic, target, output, errors)
-
 		# update LASTPOLL in persistent cfg_dict
-		cfgdic[target]['LASTPOLL'] = STR_DATETIME
+		cfgdic[target]['LASTPOLL'] = str_datetime
 
-		# Clear PID, not JSON serializable (for dbug output)
-		poldic[target]['PID'] = ''
+		# carry a new ping failure over to the persistent cfg_dict
+		cfgdic[target]['LASTFAIL'] = poldic[target]['LASTFAIL']
 
 		# Clear UPTIME, correct uptime in cfg_dict (for dbug output)
 		try: # if 1st run, UPTIME doesn't exist yet
@@ -306,345 +504,364 @@ def ping_hosts(cfgdic, poldic):
 		dbug(target, 'LASTFAIL:', cfgdic[target]['LASTFAIL'])
 		dbug(target, 'LASTPOLL:', cfgdic[target]['LASTPOLL'])
 
-	dbug("Ping data:\npoldic", json.dumps(poldic, indent=4, sort_keys=True))
+	dbug("Ping data:\npoldic", \
+		lambda: json.dumps(poldic, indent=4, sort_keys=True))
 
 # -----------------------------------------------------------------------------
-def parse_ping(poldic, key, out, err):
+def resolve_hosts(cfgdic, poldic, targets, str_epoctime):
+	'''Resolve host names at most once per DNS_TTL, return resolved targets'''
+
+	stale = []
+	for target in targets:
+		host = cfgdic[target]
+		try: # 1st run or config from older versions has no cached address
+			fresh = host['RESOLVED_FQDN'] == host['FQDN'] and \
+				int(str_epoctime) - int(host['RESOLVED']) < DNS_TTL
+		except (KeyError, ValueError): # or a hand edited RESOLVED
+			fresh = False
+		if not fresh:
+			stale.append(target)
+
+	if stale:
+		dbug('Resolving', lambda: ', '.join(cfgdic[target]['FQDN'] \
+			for target in stale))
+		results = asyncio.run(_resolve_all(cfgdic, stale))
+
+		for target, addrinfo in zip(stale, results):
+			host = cfgdic[target]
+			if isinstance(addrinfo, Exception):
+				dbug(target, 'could not resolve', host['FQDN'], addrinfo)
+				for key in ('IP', 'RESOLVED', 'RESOLVED_FQDN'):
+					host.pop(key, None)
+			else:
+				host.update({'IP': addrinfo[0][4][0], \
+					'RESOLVED': str_epoctime, 'RESOLVED_FQDN': host['FQDN']})
+
+	resolved = []
+	for target in targets:
+		if 'IP' in cfgdic[target]:
+			poldic[target]['IP'] = cfgdic[target]['IP']
+			resolved.append(target)
+		else:
+			poldic[target].update({'IP': 'UNKNOWN', 'TX': 'UNKNOWN', \
+				'RX': 'UNKNOWN', 'AVAIL': '0', 'LASTFAIL': str_epoctime, \
+				'MINRTT': 'UNKNOWN', 'AVGRTT': 'UNKNOWN', \
+				'MAXRTT': 'UNKNOWN', 'MDEV': 'UNKNOWN'})
+
+	return resolved
+
+# -----------------------------------------------------------------------------
+async def _resolve_all(cfgdic, targets):
+	'''Look up every host concurrently, return addrinfo or exception list'''
+
+	loop = asyncio.get_running_loop()
+	return await asyncio.gather(*[loop.getaddrinfo(cfgdic[target]['FQDN'], \
+		None, family=socket.AF_INET) for target in targets], \
+		return_exceptions=True)
+
+# -----------------------------------------------------------------------------
+async def _ping_all(poldic, targets):
+	'''Run ping for every host concurrently, return (stdout, stderr) list'''
+
+	tasks = []
+	for target in targets:
+		cmd = [PING, '-nqc', poldic[target]['COUNT'], poldic[target]['IP']]
+		dbug(target, cmd)
+		proc = await asyncio.create_subprocess_exec(*cmd, \
+			stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+		tasks.append(asyncio.create_task(proc.communicate()))
+
+	return await asyncio.gather(*tasks)
+
+# -----------------------------------------------------------------------------
+def icmp_allowed():
+	'''Check that a raw ICMP socket, as used by aioping, can be opened'''
+
+	try:
+		socket.socket(socket.AF_INET, socket.SOCK_RAW, \
+			socket.IPPROTO_ICMP).close()
+	except OSError: # raw ICMP sockets need root or CAP_NET_RAW
+		dbug('No permission for ICMP sockets, falling back to '+PING)
+		return False
+
+	return True
+
+# -----------------------------------------------------------------------------
+async def _icmp_ping_all(poldic, targets, str_epoctime):
+	'''ping every host concurrently from within python using aioping'''
+
+	await asyncio.gather(*[_icmp_ping(poldic, target, str_epoctime) \
+		for target in targets])
+
+# -----------------------------------------------------------------------------
+async def _icmp_ping(poldic, key, str_epoctime):
+	'''Send COUNT echo requests to one host and store the results'''
+
+	loop = asyncio.get_running_loop()
+	count = int(poldic[key]['COUNT'])
+	ipaddr = poldic[key]['IP']
+	dbug(key, 'ICMP ping', ipaddr, 'x'+str(count))
+
+	# one echo request per second, like ping
+	rtts = []
+	for seq in range(count):
+		sent = loop.time()
+		try:
+			rtts.append(1000 * await aioping.ping(ipaddr, timeout=ICMP_TIMEOUT))
+		except (TimeoutError, OSError): # lost, or host/net unreachable
+			pass
+		if seq < count - 1:
+			await asyncio.sleep(max(0, 1 - (loop.time() - sent)))
+
+	poldic[key].update({'TX': str(count), 'RX': str(len(rtts)), \
+		'AVAIL': str(round(100 * len(rtts) / count))})
+	if rtts:
+		poldic[key].update({'MINRTT': str(round(min(rtts))), \
+			'AVGRTT': str(round(statistics.mean(rtts))), \
+			'MAXRTT': str(round(max(rtts))), \
+			'MDEV': str(round(statistics.pstdev(rtts)))})
+	else:
+		poldic[key].update({'MINRTT': 'UNKNOWN', 'AVGRTT': 'UNKNOWN', \
+			'MAXRTT': 'UNKNOWN', 'MDEV': 'UNKNOWN', 'LASTFAIL': str_epoctime})
+
+# -----------------------------------------------------------------------------
+def parse_ping(poldic, key, out, err, str_epoctime):
 	'''Parse output from ping command'''
 
 	dbug('parse_ping key: '+key)
-	dbug("parse_ping input:\n"+out.decode('utf-8'))
-	dbug("parse_ping errors:\n"+err.decode('utf-8'))
+	dbug("parse_ping input:", lambda: "\n"+out.decode('utf-8'))
+	dbug("parse_ping errors:", lambda: "\n"+err.decode('utf-8'))
 
 	if err:
 		dbug('parse_ping returend an error.')
 		poldic[key].update({'IP': 'UNKNOWN', 'TX': 'UNKNOWN', 'RX': 'UNKNOWN',\
-		'AVAIL': '0', 'LASTFAIL': STR_DATETIME, \
+		'AVAIL': '0', 'LASTFAIL': str_epoctime, \
 		'MINRTT': 'UNKNOWN', 'AVGRTT': 'UNKNOWN', 'MAXRTT': 'UNKNOWN', \
 		'MDEV': 'UNKNOWN'})
 
-	elif 'PING' in out.decode('utf-8'):
-		token_specification = [r'PING\s+([\w\-.]+)\s+\(',\
-			r'(\d+\.\d+\.\d+\.\d+)',\
-			r'(\d+)\s+packets\s+transmitted,',\
-			r'(\d+)\s+received,',\
-			r'(\d+)\%\s+packet\s+loss,',\
-			r'(\d+\.\d+)/(\d+\.\d+)/(\d+\.\d+)/(\d+\.\d+)',]
-
-			# hostname [a-zA-Z0-9_.]
-			# IP Address
-			# packets transmitted
-			# packets received
-			# packet loss
-			# rtt min/AVG/max/mdev or blank line
-
-		tokens_re = re.compile(r'('+'|'.join(token_specification)+')',\
-		re.VERBOSE | re.UNICODE | re.MULTILINE)
-
-		match = []
-		match = tokens_re.findall(out.decode('utf-8'))
-		if match:
-			#dbug('parse_ping matched:\n'+str(token_specification))
-			# Store results from pings
-			poldic[key].update({'IP': match[1][2], 'TX': match[2][3], \
-				'RX':match[3][4]})
-			poldic[key].update({'AVAIL': str(100 - int(match[4][5]))})
-			if poldic[key]['AVAIL'] == '0':
+	else:
+		txd = rxd = loss = rtt = None
+		for line in out.decode('utf-8').splitlines():
+			if 'packets transmitted' in line:
+				# 5 packets transmitted, 5 received, 0% packet loss, time 4005ms
+				fields = line.split(', ')
+				txd = fields[0].split()[0]
+				rxd = fields[1].split()[0]
+				for field in fields:
+					if field.endswith('packet loss'):
+						loss = field.split('%')[0]
+			elif line.startswith('rtt '):
+				# rtt min/avg/max/mdev = 10.512/11.734/13.021/0.901 ms
+				rtt = line.split('=')[1].split()[0].split('/')
+
+		if loss:
+			# Store results from pings, IP is already set by resolve_hosts
+			poldic[key].update({'TX': txd, 'RX': rxd})
+			poldic[key].update({'AVAIL': str(round(100 - float(loss)))})
+			if poldic[key]['AVAIL'] == '0' or not rtt:
 				poldic[key].update({'MINRTT': 'UNKNOWN', \
 					'AVGRTT': 'UNKNOWN', 'MAXRTT': 'UNKNOWN',\
 					'MDEV': 'UNKNOWN', 'LASTFAIL': \
-					STR_DATETIME})
+					str_epoctime})
 			else:
-				poldic[key].update({'MINRTT': str(round(float(\
-					match[5][6]))), 'AVGRTT': str(round(float(\
-					match[5][7]))), 'MAXRTT': str(round(float(\
-					match[5][8]))), 'MDEV': str(round(float(\
-					match[5][9])))})
+				poldic[key].update({'MINRTT': str(round(float(rtt[0]))), \
+					'AVGRTT': str(round(float(rtt[1]))), \
+					'MAXRTT': str(round(float(rtt[2]))), \
+					'MDEV': str(round(float(rtt[3])))})
 
 		else:
-			dbug('ERROR: "PING" not in output.')
+			dbug('ERROR: ping statistics not in output.')
 			poldic[key].update({'IP': 'UNKNOWN', 'TX': 'UNKNOWN', \
 				'RX': 'UNKNOWN', 'AVAIL': '0', 'LASTFAIL': \
-				STR_DATETIME, 'MINRTT': 'UNKNOWN', \
+				str_epoctime, 'MINRTT': 'UNKNOWN', \
 				'AVGRTT': 'UNKNOWN', 'MAXRTT': 'UNKNOWN', 'MDEV': 'UNKNOWN'})
 
 # -----------------------------------------------------------------------------
-def update_database(poldic):
+def update_database(poldic, rrd, str_epoctime):
 	'''Generate and run the database update command for poll results'''
 
-	cmd = RRDTOOL+' update '+ARGS.cfgfile.replace('json', 'rrd')+' --template '
-
-	for target in sorted(poldic.keys()):
-		cmd += target+'-AVRTT:'+target+'-AVAIL:'
-	cmd = re.sub(r":$", " ", cmd) # remove traling colon
-	cmd += STR_EPOCTIME + ":"
-
-	for target in sorted(poldic.keys()):
-		cmd += poldic[target]['AVGRTT']+':'+poldic[target]['AVAIL']+':'
-	cmd = re.sub(r":$", "", cmd) # remove training colon
+	targets = sorted(poldic)
+	cmd = [RRDTOOL, 'update', ARGS.dbfile]
+	if ARGS.rrdcached:
+		# rrdcached does not accept --template, values go in the DS order
+		# verify_rrd created them in (sorted targets, AVRTT then AVAIL)
+		cmd.extend(['--daemon', ARGS.rrdcached])
+	else:
+		cmd.append('--template')
+		cmd.append(':'.join(target+'-AVRTT:'+target+'-AVAIL' \
+			for target in targets))
+	cmd.append(str_epoctime+':'+':'.join(poldic[target]['AVGRTT']+':'+ \
+		poldic[target]['AVAIL'] for target in targets))
 
 	dbug(LINE)
-	dbug("Update database:\n"+cmd)
+	dbug("Update database:", lambda: "\n"+' '.join(cmd))
 
-	update_cmd = [cmd]
-	try:
-		output = subprocess.check_output(update_cmd, shell=True)
-	except subprocess.CalledProcessError:
-		dbug('Exception:', 'subprocess.CalledProcessError')
-		dbug("ERROR:", "\n"+output.decode('utf-8'))
+	reply = rrdtool_send(rrd, cmd)
+	if not reply or 'ERROR:' in reply:
+		dbug("ERROR:", "\n"+reply)
 
 # -----------------------------------------------------------------------------
-def build_graph_command(poldic, gfxdic, target, intdur):
+def build_graph_templates(gfxdic):
+	'''Build the rrd graph options shared by every host for each interval'''
+
+	templates = {}
+	for intdur in gfxdic:
+		rrdopts = ['-w'+GRAPH_WIDTH, '-h'+GRAPH_HEIGHT, '-a'+'PNG']
+		rrdopts.extend(["--start", "-"+gfxdic[intdur]['duration']])
+		rrdopts.extend(["--end", "now"])
+		if ARGS.rrdcached:
+			rrdopts.extend(["--daemon", ARGS.rrdcached])
+		rrdopts.extend(["--font", "DEFAULT:7:"])
+		rrdopts.extend(["--vertical-label", "Round Trip Time latency(ms)"])
+		rrdopts.extend(["--right-axis-label", "Availability (%)"])
+		rrdopts.extend(["--lower-limit", "0"])
+		rrdopts.extend(["--right-axis", "1:0"])
+		rrdopts.extend(["--x-grid", gfxdic[intdur]['xgrid']+":0:%R"])
+		rrdopts.extend(["--alt-y-grid", "--rigid"])
+		templates[intdur] = rrdopts
+
+	return templates
+
+# -----------------------------------------------------------------------------
+def build_graph_command(poldic, gfxdic, templates, target, intdur, str_date):
 	'''Build rrd graph commands for each interval'''
 
-	str_date = datetime.now().strftime("%c")
 	poldic[target]['graph-'+intdur] = \
 		ARGS.htmldir+target+intdur+".png"
-	rrdcmd = [RRDTOOL]
-	rrdcmd.append("graph")
-	rrdcmd.append(ARGS.htmldir+target+intdur+".png")
-	rrdcmd.append('-w'+GRAPH_WIDTH+' -h'+GRAPH_HEIGHT)
-	rrdcmd.append('-a'+'PNG')
-	rrdcmd.append("--start")
-	rrdcmd.append("-"+gfxdic[intdur]['duration'])
-	rrdcmd.append("--end")
-	rrdcmd.append("now")
-	rrdcmd.append("--font")
-	rrdcmd.append("DEFAULT:7:")
+	rrdcmd = [RRDTOOL, "graph", ARGS.htmldir+target+intdur+".png"]
+	rrdcmd.extend(templates[intdur])
 	rrdcmd.append("--title")
 	rrdcmd.append("Multi Host Availability Grapher - "+target+ \
 		" ("+intdur+")")
 	rrdcmd.append("--watermark")
 	rrdcmd.append(str_date+' - '+poldic[target]['FQDN']+ \
 		' ['+poldic[target]['IP']+']')
-	rrdcmd.append("--vertical-label")
-	rrdcmd.append("Round Trip Time latency(ms)")
-	rrdcmd.append("--right-axis-label")
-	rrdcmd.append("Availability (%)")
-	rrdcmd.append("--lower-limit")
-	rrdcmd.append("0")
-	rrdcmd.append("--right-axis")
-	rrdcmd.append("1:0")
-	rrdcmd.append("--x-grid")
-	rrdcmd.append(gfxdic[intdur]['xgrid']+":0:%R")
-	rrdcmd.append("--alt-y-grid")
-	rrdcmd.append("--rigid")
-	rrdcmd.append("DEF:"+target+"AVRTT="+ARGS.dbfile+":"+target+"-AVRTT:"\
+	rrdcmd.append("DEF:AVRTT="+ARGS.dbfile+":"+target+"-AVRTT:"\
 		+gfxdic[intdur]['rra']+ ":step="+gfxdic[intdur]['step'])
-	rrdcmd.append("DEF:"+target+"AVAIL="+ARGS.dbfile+":"+target+"-AVAIL:"\
+	rrdcmd.append("DEF:AVAIL="+ARGS.dbfile+":"+target+"-AVAIL:"\
 		+gfxdic[intdur]['rra']+ ":step="+gfxdic[intdur]['step'])
-
-	rrdcmd.append("CDEF:AVAIL1="+target+"AVAIL,0,20,LIMIT,UN,UNKN,INF,IF")
-	rrdcmd.append("CDEF:AVAIL2="+target+"AVAIL,21,40,LIMIT,UN,UNKN,INF,IF")
-	rrdcmd.append("CDEF:AVAIL3="+target+"AVAIL,39,79,LIMIT,UN,UNKN,INF,IF")
-	rrdcmd.append("CDEF:AVAIL4="+target+"AVAIL,80,99,LIMIT,UN,UNKN,INF,IF")
-	rrdcmd.append("CDEF:AVAIL5="+target+"AVAIL,100,100,LIMIT,UN,UNKN,INF,IF")
-
-	rrdcmd.append('COMMENT:Availability\:')
-	rrdcmd.append("AREA:AVAIL1#FF0000:0-20%")
-	rrdcmd.append("AREA:AVAIL2#FFFF00:21-40%")
-	rrdcmd.append("AREA:AVAIL3#FF8000:39-79%")
-	rrdcmd.append("AREA:AVAIL4#00FFFF:80-99%")
-	rrdcmd.append("AREA:AVAIL5#00FF00:100%")
-
-	rrdcmd.append('LINE1:'+target+'AVRTT#0000ff:RTT latency ms')
-	rrdcmd.append('GPRINT:'+target+'AVRTT:LAST:Current RTT\: %5.2lf ms')
-	rrdcmd.append('GPRINT:'+target+'AVRTT:AVERAGE:Avg RTT\: %5.2lf ms')
-	rrdcmd.append('GPRINT:'+target+'AVRTT:MAX:Max RTT\: %5.2lf ms')
-	rrdcmd.append('GPRINT:'+target+'AVRTT:MIN:Min RTT\: %5.2lf ms')
+	rrdcmd.extend(GRAPH_ELEMENTS)
 
 	return rrdcmd
 
 # -----------------------------------------------------------------------------
-def gen_graphs(poldic, gfxdic):
+def gen_graphs(poldic, gfxdic, stack, rrds):
 	'''Generate graphs'''
 
 	dbug(LINE)
 	dbug('Spawn graph generation commands...')
 
-	# Build command and launch each subprocess
-	gfxprm_sort = OrderedDict(sorted(gfxdic.items(), key=lambda \
-		x: int(x[1]['step'])))
+	# Only the title, watermark and DEFs differ between hosts
+	templates = build_graph_templates(gfxdic)
+	str_date = datetime.now().strftime("%c")
 
+	jobs = []
 	for target in sorted(poldic.keys()):
-		for intvldur in gfxprm_sort:
-			cmd = build_graph_command(poldic, gfxdic, target, intvldur)
-			poldic[target][intvldur] = subprocess.Popen(cmd, \
-				stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		for intvldur in gfxdic:
+			jobs.append((target, intvldur, build_graph_command(poldic, \
+				gfxdic, templates, target, intvldur, str_date)))
+
+	# Start rrdtool processes only as far as there are graphs for them, they
+	# stay in rrds (and on the ExitStack) for the next --loop cycle
+	while len(rrds) < min(RRDTOOL_WORKERS, len(jobs)):
+		rrds.append(stack.enter_context(rrdtool_start()))
+	workers = rrds[:max(1, len(jobs))]
+
+	# Share the graphs out between the rrdtool processes, one thread feeding
+	# each, so no more than RRDTOOL_WORKERS graphs are drawn at once
+	with ThreadPoolExecutor(max_workers=len(workers)) as pool:
+		futures = [pool.submit(feed_rrdtool, rrd, jobs[num::len(workers)]) \
+			for num, rrd in enumerate(workers)]
+		for future in as_completed(futures):
+			for target, intvldur, reply in future.result():
+				dbug(target, intvldur, "rrdtool graph:", \
+					reply.replace('\n', ''))
 
-	# Wait for each child process to end
-	for target in sorted(poldic.keys()):
-		for intvldur in gfxprm_sort:
-			poldic[target][intvldur].wait()
+	dbug('Graph generation complete')
 
-	# Read STDOUT and STDERR from each child process
-	for target in sorted(poldic.keys()):
-		for intvldur in gfxprm_sort:
-			out, err = poldic[target][intvldur].communicate()
-			#dbug(target, intvldur, poldic[target][intvldur].args)
-			dbug(target, intvldur, "rrdtool graph STDOUT:", \
-				out.decode('utf-8').replace('\n', ''))
-			dbug(target, intvldur, "rrdtool graph STDERR:", \
-				err.decode('utf-8').replace('\n', ''))
-
-	# Clear PID, not JSON serializable (for dbug output)
-	for target in sorted(poldic.keys()):
-		for intvldur in gfxprm_sort:
-			del poldic[target][intvldur]
+# -----------------------------------------------------------------------------
+def rrdtool_start():
+	'''Start a "rrdtool -" process to feed rrdtool commands to'''
 
-	dbug('Graph generation complete')
+	return subprocess.Popen([RRDTOOL, '-'], stdin=subprocess.PIPE, \
+		stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+# -----------------------------------------------------------------------------
+def restart_rrdtool(stack, rrds):
+	'''Replace any "rrdtool -" process in the pool that has exited'''
+
+	for idx, rrd in enumerate(rrds):
+		if rrd.poll() is not None:
+			dbug('rrdtool worker', idx, 'exited with', rrd.returncode)
+			for pipe in (rrd.stdin, rrd.stdout):
+				try:
+					pipe.close()
+				except OSError: # unflushed input to a dead process
+					pass
+			rrds[idx] = stack.enter_context(rrdtool_start())
+
+# -----------------------------------------------------------------------------
+def rrdtool_send(rrd, cmd):
+	'''Send an argv style command to a "rrdtool -" process, return reply'''
+
+	rrd.stdin.write((' '.join(shlex.quote(arg) for arg in cmd[1:]) + \
+		'\n').encode('utf-8'))
+	rrd.stdin.flush()
+
+	# the reply ends with an OK or ERROR line
+	reply = ''
+	for line in rrd.stdout:
+		reply += line.decode('utf-8')
+		if line.startswith((b'OK ', b'ERROR:')):
+			break
+
+	return reply
+
+# -----------------------------------------------------------------------------
+def feed_rrdtool(rrd, jobs):
+	'''Send (target, intvldur, cmd) jobs to one rrdtool process in turn'''
+
+	return [(target, intvldur, rrdtool_send(rrd, cmd)) \
+		for target, intvldur, cmd in jobs]
 
 # -----------------------------------------------------------------------------
 def gen_html_index(poldic, gfxdic):
 	'''Generate HTML '''
 
-	idx = open(ARGS.htmldir+'/'+'mhag.html', 'w')
-	idx.write('<!DOCTYPE html>\n')
-	idx.write('<html>\n')
-	idx.write('\t<head>\n')
-	idx.write('\t\t<title>Multi Host Availability Grapher</title>\n')
-	idx.write('\t\t<meta http-equiv="refresh" content="60">\n')
-	idx.write('\t\t<meta http-equiv="cache-Control" content="no-cache">\n')
-	idx.write('\t\t<meta http-equiv="pragma" content="no-cache">\n')
 	one_min_from_now = datetime.now(timezone('UTC')) + timedelta(minutes=1)
-	idx.write('\t\t<meta http-equiv="expires" content="' + \
-		one_min_from_now.strftime("%c %Z")+'">\n')
-	idx.write('\t\t<meta http-equiv="generator" content="MHAG '+VER+'">\n')
-	idx.write('\t\t<meta http-equiv="date" content="' + \
-		one_min_from_now.strftime("%c %Z")+'">\n')
-	idx.write('\t\t<meta http-equiv="content-type" content="text/html;' + \
-		' charset=iso-8859-15">')
-	idx.write('\t\t<style type="text/css">\n')
-	idx.write('\t\t</style>\n')
+	expires = one_min_from_now.strftime("%c %Z")
 
-	idx.write('\t</head>\n')
-	idx.write('<body>\n')
-	idx.write('<h1>Multi Host Availability Grapher</h1>\n')
+	rows = []
+	for target in sorted(poldic.keys()):
+		rows.append(HTML_INDEX_ROW.format(target=target))
 
-	idx.write('<table border=0 cellpadding=0 cellspacing=10>\n')
+		graphs = []
+		for intvldur in gfxdic:
+			dbug("graph name: "+ARGS.htmldir+target+intvldur+'.png')
+			graphs.append(HTML_GRAPH.format(target=target, intvldur=intvldur))
 
-	gfxprm_sort = OrderedDict(sorted(gfxdic.items(), key=lambda \
-		x: int(x[1]['step'])))
+		with open(ARGS.htmldir+'/'+target+'.html', 'w') as tgt:
+			tgt.write(HTML_HEAD.format(title='Multi Host Availability ' + \
+				'Grapher - '+target, expires=expires, ver=VER, \
+				style=inline_style()) + ''.join(graphs) + HTML_FOOT)
 
-	for target in sorted(poldic.keys()):
-		idx.write('<tr><td><div><b>'+target+'</b></div>')
-		idx.write('<div><a href="'+target+'.html"><img border=1 \
-			src="'+target+'1mx12h.png" title="1mx12h" \
-			alt="1mx12h"></a><br></div></td></tr>\n')
-
-		tgt = open(ARGS.htmldir+'/'+target+'.html', 'w')
-		tgt.write('<!DOCTYPE html>\n')
-		tgt.write('<html>\n')
-		tgt.write('\t<head>\n')
-		tgt.write('\t\t<title>Multi Host Availability Grapher - '+target+ \
-			'</title>\n')
-		tgt.write('\t\t<meta http-equiv="refresh" content="60">\n')
-		tgt.write('\t\t<meta http-equiv="cache-control" content="no-cache">\n')
-		tgt.write('\t\t<meta http-equiv="pragma" content="no-cache">\n')
-		tgt.write('\t\t<meta http-equiv="expires" content="' + \
-			one_min_from_now.strftime("%c %Z")+'">\n')
-		tgt.write('\t\t<meta http-equiv="generator" content="MHAG ' + \
-			VER+'">\n')
-		tgt.write('\t\t<meta http-equiv="date" content="' + \
-			one_min_from_now.strftime("%c %Z")+'">\n')
-		tgt.write('\t\t<meta http-equiv="content-type" content="text/html;' + \
-			' charset=iso-8859-15">')
-		tgt.write(inline_style())
-		tgt.write('\t</head>\n')
-		tgt.write('\t<body>\n')
-		tgt.write('\t\t<h1>Multi Host Availability Grapher - '+target+'</h1>\n')
-
-		for intvldur in gfxprm_sort:
-			dbug("graph name: "+ARGS.htmldir+target+intvldur+'.png')
-			tgt.write('\t\t<div class="graph">')
-			tgt.write('\t\t\t<h2>'+target+' ('+intvldur+')</h2>\n')
-			tgt.write('<img src="'+target+intvldur+'.png" \
-				title="'+intvldur+'" alt="'+intvldur+'">\n')
-			tgt.write('\t\t</div>\n')
-
-		tgt.write('\t<div align="right">')
-		tgt.write('<a href="https://github.com/jullrey/MHAG/blob/master/LICENSE" target="MHAG License">')
-		tgt.write('<i>MHAG License</i></a>')
-		tgt.write('</div>\n')
-		tgt.write('\t</body>\n')
-		tgt.write('</html>\n')
-		tgt.close()
-
-	idx.write('</table>\n')
-	idx.write('\t<div align="right">')
-	idx.write('<a href="https://github.com/jullrey/MHAG/blob/master/LICENSE" target="MHAG License">')
-	idx.write('<i>MHAG License</i></a>')
-	idx.write('</div>\n')
-	idx.write('</body>\n')
-	idx.write('</html>\n')
-	idx.close()
+	with open(ARGS.htmldir+'/'+'mhag.html', 'w') as idx:
+		idx.write(HTML_HEAD.format(title='Multi Host Availability Grapher', \
+			expires=expires, ver=VER, style='') + \
+			HTML_INDEX_TABLE.format(rows=''.join(rows)) + HTML_FOOT)
 
 # -----------------------------------------------------------------------------
 def inline_style():
 	'''return the inline text/css style sheet'''
-	multi_line = '''
-		                <style type="text/css">
-                        body {
-                                background-color: #ffffff;
-                        }
-                        div {
-                                border-bottom: 2px solid #aaa;
-                                padding-bottom: 10px;
-                                margin-bottom: 5px;
-                        }
-                        div h2 {
-                                font-size: 1.2em;
-                        }
-                        div.graph img {
-                                margin: 5px 0;
-                        }
-                        div.graph table, div#legend table {
-                                font-size: .8em;
-                        }
-                        div.graph table td {
-                                padding: 0 10px;
-                                text-align: right;
-                        }
-                        div table .in th, div table td span.in {
-                                color: #00cc00;
-                        }
-                        div table .out th, div table td span.out {
-                                color: #0000ff;
-                        }
-                        div#legend th {
-                                text-align: right;
-                        }
-                        div#footer {
-                                border: none;
-                                font-size: .8em;
-                                font-family: Arial, Helvetica, sans-serif;
-                                width: 476px;
-                        }
-                        div#footer img {
-                                border: none;
-                                height: 25px;
-                        }
-                        div#footer address {
-                                text-align: right;
-                        }
-                        div#footer #version {
-                                margin: 0;
-                                padding: 0;
-                                float: left;
-                                width: 88px;
-                                text-align: right;
-                        }
-                </style>
-'''
-
-	return multi_line
+	return HTML_STYLE
 
 # -----------------------------------------------------------------------------
 def dbug(*args, **kwargs):
-	'''Pring Debugging info'''
+	'''Pring Debugging info, callable args are only evaluated when debugging'''
 	if ARGS.DEBUG:
 		print("DEBUG: ", file=sys.stderr, end="")
-		print(*args, file=sys.stderr, **kwargs, flush=True)
+		print(*[arg() if callable(arg) else arg for arg in args], \
+			file=sys.stderr, **kwargs, flush=True)
 
 # -----------------------------------------------------------------------------
 def parse_args():
@@ -655,6 +872,11 @@ def parse_args():
 	Parse and format ping output to work with RRD (MRTG).''',
 		epilog='''Example:
 	/home/pi/bin/mhag.py -D /home/pi/data -H /var/www/html/graphs
+
+Run continuously, with rrdcached buffering the database writes:
+	rrdcached -l unix:/tmp/rrdcached.sock -w 300 -f 3600
+	/home/pi/bin/mhag.py -D /home/pi/data -H /var/www/html/graphs \\
+		-L -R unix:/tmp/rrdcached.sock
 	''')
 
 	parser.add_argument('-d', '--debug', action='store_true', dest='DEBUG', \
@@ -670,6 +892,10 @@ def parse_args():
 	parser.add_argument('-H', '--html', dest='htmldir', default='', \
 		help='directory to store html and graph files', \
 		required=True)
+	parser.add_argument('-L', '--loop', action='store_true', dest='loop', \
+		help='keep running and poll every minute instead of once (cron)')
+	parser.add_argument('-R', '--rrdcached', dest='rrdcached', default='', \
+		help='rrdcached address for rrdtool --daemon (e.g. unix:/path.sock)')
 	if len(sys.argv) == 1:
 		parser.print_help(sys.stderr)
 		sys.exit(1)
@@ -683,6 +909,9 @@ def parse_args():
 # --- Required mechanism to start main() function -----------------------------
 # -----------------------------------------------------------------------------
 if __name__ == '__main__':
+	# asyncio.run(), subprocess capture_output and ordered dicts need 3.7
+	if sys.version_info < (3, 7):
+		sys.exit('mhag.py needs python3 >= 3.7, found '+sys.version.split()[0])
 	ARGS = parse_args()
 	main()
 